@@ -1,12 +1,14 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 import datetime
 from agent import Agent
-import json
+import orjson
 import re
 import base64
+import hashlib
+import uuid
 
 
 # Load environment variables
@@ -16,6 +18,7 @@ st.set_page_config(page_title="Trip Genie", layout="wide")
 
 # Constants
 CURRENT_YEAR = datetime.datetime.now().year
+JSON_BLOCK_RE = re.compile(r'```json\n(.*?)\n```', re.DOTALL)
 response =""
 
 
@@ -28,6 +31,11 @@ def get_base64_image(path):
     with open(path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode()
 
+# Agent shared across reruns so the graph and its checkpointer are built only once
+@st.cache_resource
+def get_agent():
+    return Agent()
+
 # Show background image until user clicks in the start button
 if not st.session_state.start_clicked:
     background_base64 = get_base64_image("images/Trip_Genie.png")
@@ -65,7 +73,7 @@ if not st.session_state.start_clicked:
 else:
 
     # Instantiate the agent
-    agent = Agent()
+    agent = get_agent()
     response = ""
 
     if "show_form" not in st.session_state:
@@ -117,7 +125,7 @@ else:
             origin = st.text_input("Origin 🏠")
 
         with col2:
-            destination = st.text_input("Destination 🌆")
+            destination = st.text_input("Destination 🌆", help="Separate several destinations with commas to compare them")
 
         with col3:
             start_date = st.date_input("Start date 📅", datetime.date.today())
@@ -161,13 +169,22 @@ Avoid: {avoid}
 children: {children}
 adult: {adult}
 """
+        # Asking for the same trip again means the user wants a different plan
+        st.session_state.regenerate = user_message == st.session_state.get("user_prompt")
         st.session_state.user_prompt = user_message
         st.session_state.origin = origin
         st.session_state.destination = destination
         st.session_state.start_date = start_date
         st.session_state.end_date = end_date
         st.session_state.adult = adult
-        st.session_state.chat_history = [HumanMessage(content=user_message)]
+        # A content-derived id keeps the message (and the LLM cache key) identical for a repeated trip;
+        # otherwise add_messages would stamp it with a random id
+        message_id = hashlib.sha256(user_message.encode()).hexdigest()
+        st.session_state.chat_history = [HumanMessage(content=user_message, id=message_id)]
+        # The checkpointer is shared by all sessions, so drop this session's previous trip
+        if "thread_id" in st.session_state:
+            agent.graph.checkpointer.delete_thread(st.session_state.thread_id)
+        st.session_state.thread_id = f"travel_agent_session-{uuid.uuid4().hex}"
         st.rerun()
 
         #st.session_state.show_form = False
@@ -176,31 +193,76 @@ adult: {adult}
 
 # Run agent if user_prompt exists
 if "user_prompt" in st.session_state:
-    with st.spinner("Planning your trip..."):
-        valid_messages = [msg for msg in st.session_state.chat_history if getattr(msg, "content", "").strip()]
-        if valid_messages:
-            events = agent.graph.invoke(
-                {"messages": valid_messages},
-                config={"thread_id": "travel_agent_session"}
-            )
-            
-            ai_msg = events['messages'][1]  # AIMessage object
+    valid_messages = [msg for msg in st.session_state.chat_history if getattr(msg, "content", "").strip()]
+    if valid_messages:
+        config = {"configurable": {
+            "thread_id": st.session_state.thread_id,
+            "regenerate": st.session_state.get("regenerate", False)
+        }}
+
+        # Reruns read the checkpointed result instead of running the agent again,
+        # but only a finished run (a final AIMessage without tool calls) is reused
+        messages = agent.graph.get_state(config).values.get("messages", [])
+        finished = messages and isinstance(messages[-1], AIMessage) and not messages[-1].tool_calls
+        if not finished:
+            if messages:
+                # An earlier run stopped partway; start this trip over on a clean thread
+                agent.graph.checkpointer.delete_thread(st.session_state.thread_id)
+
+            # Stream node updates so tool progress shows up while the agent works
+            with st.status("Planning your trip...") as status:
+                failed_lookups = False
+                try:
+                    for chunk in agent.graph.stream(
+                        {"messages": valid_messages},
+                        config=config,
+                        stream_mode="updates"
+                    ):
+                        for update in chunk.values():
+                            for msg in update["messages"]:
+                                if isinstance(msg, ToolMessage):
+                                    if msg.status == "error":
+                                        failed_lookups = True
+                                        status.write(f"❌ {msg.name} failed")
+                                    else:
+                                        status.write(f"✅ {msg.name} finished")
+                                elif msg.tool_calls:
+                                    status.write(f"🔎 Calling {', '.join(call['name'] for call in msg.tool_calls)}...")
+                except Exception as e:
+                    agent.graph.checkpointer.delete_thread(st.session_state.thread_id)
+                    status.update(label="Planning failed", state="error", expanded=False)
+                    st.error(f"Planning your trip failed: {e}. Please try again.")
+                    st.stop()
+
+                if failed_lookups:
+                    status.update(label="Trip planned, but some lookups failed", state="error", expanded=False)
+                else:
+                    status.update(label="Trip planned!", state="complete", expanded=False)
+            messages = agent.graph.get_state(config).values["messages"]
+
+        ai_msg = messages[-1]  # Final AIMessage object
+
+        # Parse each AI message once; reruns reuse the parsed response
+        if "parsed_response" not in st.session_state or st.session_state.parsed_msg_id != ai_msg.id:
             content = ai_msg.content        # This is the string that contains the ```json ... ``` block
 
             # Step 2: Extract JSON from content
-            json_match = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
-
+            json_match = JSON_BLOCK_RE.search(content)
 
             if json_match:
                 json_str = json_match.group(1)
-                response = json.loads(json_str)
+                st.session_state.parsed_response = orjson.loads(json_str)
                 print("✅ Parsed JSON:")
-                print(response)
+                print(st.session_state.parsed_response)
             else:
+                st.session_state.parsed_response = ""
                 print("❌ JSON block not found in cleaned_str.")
-            
-        else:
-            st.warning("Please enter a valid message before generating the trip plan.")
+            st.session_state.parsed_msg_id = ai_msg.id
+
+        response = st.session_state.parsed_response
+
+    else:
+        st.warning("Please enter a valid message before generating the trip plan.")
 
 if response:
     st.markdown("###")
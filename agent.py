@@ -1,28 +1,40 @@
+import asyncio
 import datetime
+import functools
+import threading
 from hotel_tool import hotels_finder, HotelsInput
 from flight_tool import flights_finder, FlightsInput
+from batch_tool import batch_tool, BatchInput
 from typing import Annotated, TypedDict
-import operator
+from cachetools import TTLCache, cached
 from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.caches import InMemoryCache
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 import streamlit as st
-import json
+import orjson
 import os
 
 # Constants
-CURRENT_YEAR = datetime.datetime.now().year
+MAX_TOOL_CONCURRENCY = 8
+MAX_CALLS_PER_TOOL = 5
+LLM_CACHE_SIZE = 128
+TOOL_CACHE_SIZE = 256
+TOOL_CACHE_TTL = 600  # seconds, prices move so keep it short
 
 # Define agent state
 class AgentState(TypedDict):
-    messages: Annotated[list, operator.add]
+    messages: Annotated[list, add_messages]
 
-# System prompt with DETAILED example tool call
-TOOLS_SYSTEM_PROMPT = f"""You are a smart travel agency. Use the tools to look up information.
+# System prompt with DETAILED example tool call.
+# Kept fully static so the prefix is identical on every turn and can be prompt-cached.
+TOOLS_SYSTEM_PROMPT = """You are a smart travel agency. Use the tools to look up information.
 You are allowed to make multiple calls (either together or in sequence).
 Only look up information when you are sure of what you want.
-The current year is {CURRENT_YEAR}.
+If the user gives several destinations (e.g. "Paris, Rome, Lisbon"), look up hotels and flights for every destination in the same turn, all calls together, so they run in parallel.
+Compare the options, build the itinerary for the best one, and explain the comparison in "general".
 
 In your json output always include:
 - name and rating of the hotel
@@ -54,39 +66,58 @@ Use the following logic for hotel_class selection based on budget:
 
 Example Tool Calls:
 
-hotels_finder({{
-    "q": "Paris",
-    "check_in_date": "2024-07-01",
-    "check_out_date": "2024-07-05",
-    "adults": 2,
-    "children": 1,
-    "rooms": 1,
-    "hotel_class": "3,4",
-    "sort_by": 8
-}})
-
-flights_finder({{
-    "departure_airport": "JFK",
-    "arrival_airport": "CDG",
-    "outbound_date": "2024-07-01",
-    "return_date": "2024-07-05",
-    "adults": 2,
-    "children": 0
-}})
+hotels_finder({
+    "params": {
+        "q": "Paris",
+        "check_in_date": "2024-07-01",
+        "check_out_date": "2024-07-05",
+        "adults": 2,
+        "children": 1,
+        "rooms": 1,
+        "hotel_class": "3,4",
+        "sort_by": 8
+    }
+})
+
+flights_finder({
+    "params": {
+        "departure_airport": "JFK",
+        "arrival_airport": "CDG",
+        "outbound_date": "2024-07-01",
+        "return_date": "2024-07-05",
+        "adults": 2,
+        "children": 0
+    }
+})
+
+When you need both hotels and flights, request them together in a single batch_tool call so they run in parallel:
+
+batch_tool({
+    "invocations": [
+        {
+            "tool_name": "hotels_finder",
+            "arguments": "{\\"params\\": {\\"q\\": \\"Paris\\", \\"check_in_date\\": \\"2024-07-01\\", \\"check_out_date\\": \\"2024-07-05\\", \\"adults\\": 2, \\"hotel_class\\": \\"3,4\\"}}"
+        },
+        {
+            "tool_name": "flights_finder",
+            "arguments": "{\\"params\\": {\\"departure_airport\\": \\"JFK\\", \\"arrival_airport\\": \\"CDG\\", \\"outbound_date\\": \\"2024-07-01\\", \\"return_date\\": \\"2024-07-05\\", \\"adults\\": 2}}"
+        }
+    ]
+})
 
 When booking flights, automatically determine the closest major airport to a given city using a predefined mapping (e.g., Paris → CDG, Madrid → MAD). Do not ask the user for airport codes. If the city is not in the mapping, make a reasonable assumption based on well-known airport locations.
 
 Please include complete flight information — both outbound (origin to destination) and return (destination to origin) segments.
 IMPORTANT: You must return **only valid JSON** in your response. Do not include any text, titles, explanations, or markdown. The entire response must be a single JSON object exactly in the format shown above. If a value is missing, use null or an empty string, but keep the JSON structure intact.
-{{
+{
   "general": "general information about the vacation",
-  "hotel": {{
+  "hotel": {
     "name": "Tokyo Stay",
     "price_per_night": "$150",
     "rating": 4.5
-  }},
-  "flight": {{
-  "outbound": {{
+  },
+  "flight": {
+  "outbound": {
     "airline": "Air France",
     "departure_time": "10:15",
     "arrival_time": "14:30",
@@ -94,8 +125,8 @@ IMPORTANT: You must return **only valid JSON** in your response. Do not include
     "arrival_airport": "CDG",
     "price": "$600",
     "link": "https://booking.airfrance.com"
-  }},
-  "return": {{
+  },
+  "return": {
     "airline": "Air France",
     "departure_time": "12:00",
     "arrival_time": "15:45",
@@ -103,63 +134,105 @@ IMPORTANT: You must return **only valid JSON** in your response. Do not include
     "arrival_airport": "JFK",
     "price": "$580",
     "link": "https://booking.airfrance.com"
-  }}
-  }},
+  }
+  },
   "plan": [
-    {{
+    {
       "day1": [
-        {{
+        {
           "time": "10:00",
           "type": "Visit",
           "description": "Tokyo National Museum"
-        }},
-        {{
+        },
+        {
           "time": "13:00",
           "type": "Lunch",
           "description": "Sushi Dai"
-        }},
-        {{
+        },
+        {
           "time": "15:00",
           "type": "Explore",
           "description": "Akihabara"
-        }}
+        }
       ],
       "day2": [
-        {{
+        {
           "time": "10:00",
           "type": "Visit",
           "description": "Tokyo National Museum"
-        }},
-        {{
+        },
+        {
           "time": "13:00",
           "type": "Lunch",
           "description": "Sushi Dai"
-        }},
-        {{
+        },
+        {
           "time": "15:00",
           "type": "Explore",
           "description": "Akihabara"
-        }}
+        }
       ]
-    }}
+    }
   ]
-}}
+}
 
 """
 
+_SYSTEM_MSG = SystemMessage(content=TOOLS_SYSTEM_PROMPT)
+
+# Date context message, rebuilt only when the day changes
+@functools.lru_cache(maxsize=1)
+def _date_message(today):
+    return SystemMessage(content=f"The current year is {today.year}. Today is {today}.")
+
 
 # Define agent tools
-TOOLS = [hotels_finder,flights_finder]
+TOOLS = [hotels_finder,flights_finder,batch_tool]
+
+_TOOLS_BY_NAME = {t.name: t for t in TOOLS}
+_TOOL_INPUTS = {"hotels_finder": HotelsInput, "flights_finder": FlightsInput}
+
+# SerpAPI lookups are deterministic in their input, so identical searches within
+# TOOL_CACHE_TTL reuse the previous result. Hit/miss counts via _cached_tool.cache_info().
+@cached(TTLCache(maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL), lock=threading.Lock(), info=True)
+def _cached_tool(name, params_json):
+    return _TOOLS_BY_NAME[name].invoke({"params": _TOOL_INPUTS[name].parse_raw(params_json)})
+
+# Turn a gathered (result, ok) pair or raised exception into (result, ok)
+def _unpack_outcome(outcome):
+    if isinstance(outcome, Exception):
+        return f"Tool call failed: {outcome}", False
+    return outcome
+
+# City -> IATA mapping, loaded once per process (the module outlives Streamlit reruns)
+@functools.lru_cache(maxsize=1)
+def _load_cities_iata():
+    with open("cities_iata.json", "rb") as f:
+        return {city.lower(): code for city, code in orjson.loads(f.read()).items()}
+
+# The destination field may list several cities; defaults only ever use the first one
+def _first_destination():
+    destinations = [d.strip() for d in st.session_state.get("destination", "").split(",")]
+    return destinations[0]
+
+# Gemini clients, built once and shared by every Agent.
+# The cached one answers a repeated prompt from memory; the uncached one is used when
+# the user explicitly regenerates the same trip and expects a different plan.
+@functools.lru_cache(maxsize=2)
+def _get_llm(cached=True):
+    return ChatGoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        temperature=0.7,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        cache=InMemoryCache(maxsize=LLM_CACHE_SIZE) if cached else False
+    )
 
 # Build the agent class
 class Agent:
     def __init__(self):
         self._tools = {t.name: t for t in TOOLS}
-        self._tools_llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            temperature=0.7,
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        ).bind_tools(TOOLS)
+        self._tools_llm = _get_llm().bind_tools(TOOLS)
+        self._fresh_tools_llm = _get_llm(cached=False).bind_tools(TOOLS)
 
         builder = StateGraph(AgentState)
         builder.add_node("call_tools_llm", self.call_tools_llm)
@@ -181,73 +254,124 @@ class Agent:
             return "more_tools"
         return "end"
 
-    def call_tools_llm(self, state: AgentState):
-        messages = [SystemMessage(content=TOOLS_SYSTEM_PROMPT)] + state["messages"]
-        message = self._tools_llm.invoke(messages)
+    def call_tools_llm(self, state: AgentState, config):
+        # Dynamic context goes after the static prompt so the cached prefix stays intact
+        context = (_SYSTEM_MSG, _date_message(datetime.date.today()))
+        regenerate = config.get("configurable", {}).get("regenerate", False)
+        llm = self._fresh_tools_llm if regenerate else self._tools_llm
+        message = llm.invoke((*context, *state["messages"]))
         return {"messages": [message]}
 
     def invoke_tools(self, state: AgentState):
         tool_calls = state["messages"][-1].tool_calls
+        return {"messages": asyncio.run(self._invoke_tools_concurrently(tool_calls))}
+
+    async def _invoke_tools_concurrently(self, tool_calls):
+        # Tool calls are independent SerpAPI lookups, so run them side by side
+        semaphore = asyncio.Semaphore(MAX_TOOL_CONCURRENCY)
+        tool_semaphores = {name: asyncio.Semaphore(MAX_CALLS_PER_TOOL) for name in self._tools}
+        outcomes = await asyncio.gather(
+            *[self._run_one(t, semaphore, tool_semaphores) for t in tool_calls],
+            return_exceptions=True
+        )
+
+        results = []
+        for t, outcome in zip(tool_calls, outcomes):
+            result, ok = _unpack_outcome(outcome)
+            # Ids derived from the tool call keep the next model call's cache key stable
+            results.append(ToolMessage(
+                tool_call_id=t["id"],
+                name=t["name"],
+                content=str(result),
+                id=f"{t['id']}-result",
+                status="success" if ok else "error"
+            ))
+        return results
+
+    async def _run_one(self, t, semaphore, tool_semaphores):
+        # Returns (result, ok) so callers can flag failures without inspecting the content
+        if t["name"] not in self._tools:
+            return "Invalid tool", False
+
+        if t["name"] == "batch_tool":
+            return await self._run_batch(t, semaphore, tool_semaphores)
+
+        parsed_args = self._parse_args(t["name"], t.get("args", {}))
+        if parsed_args is None:
+            return "Unsupported tool", False
+
+        # Take the per-tool slot first so waiting calls don't hold global slots
+        async with tool_semaphores[t["name"]], semaphore:
+            return await asyncio.to_thread(_cached_tool, t["name"].strip(), parsed_args.json()), True
+
+    async def _run_batch(self, t, semaphore, tool_semaphores):
+        # Unpack the batch into regular tool calls and fan them out like any other turn
+        args = t.get("args", {})
+        batch = BatchInput(**args.get("params", args))
+        outcomes = await asyncio.gather(
+            *[
+                self._run_invocation(invocation, f"{t['id']}-{i}", semaphore, tool_semaphores)
+                for i, invocation in enumerate(batch.invocations)
+            ],
+            return_exceptions=True
+        )
+
         results = []
-        for t in tool_calls:
-            if t["name"] not in self._tools:
-                result = "Invalid tool"
-            else:
-                args = t.get("args", {})
-
-                try:
-                    if t["name"] == "hotels_finder":
-                        if "q" not in args:
-                            args["q"] = st.session_state.get("destination", "")
-                        if "check_in_date" not in args:
-                            args["check_in_date"] = str(st.session_state.get("start_date", datetime.date.today()))
-                        if "check_out_date" not in args:
-                            args["check_out_date"] = str(st.session_state.get("end_date", datetime.date.today()))
-                        if "adults" not in args:
-                            args["adults"] = 2
-                        if "hotel_class" not in args:
-                            budget = st.session_state.get("budget", "Medium").lower()
-                            if budget == "low":
-                                args["hotel_class"] = "1,2"
-                            elif budget == "medium":
-                                args["hotel_class"] = "3,4"
-                            elif budget == "high":
-                                args["hotel_class"] = "5"
-                        if "sort_by" not in args:
-                            budget = st.session_state.get("budget", "Medium").lower()
-                            args["sort_by"] = "3" if budget == "low" else "8"
-
-                        parsed_args = HotelsInput(**args)
-
-                    elif t["name"] == "flights_finder":
-                        with open("cities_iata.json", "r", encoding="utf-8") as f:
-                            cities_iata = json.load(f)
-                        
-                        if "departure_airport" not in args:
-                            args["departure_airport"] = cities_iata.get(st.session_state.get("origin", "").lower())
-                        if "arrival_airport" not in args:
-                            args["arrival_airport"] = cities_iata.get(st.session_state.get("destination", "").lower())
-                        if "outbound_date" not in args:
-                            args["outbound_date"] = str(st.session_state.get("start_date", datetime.date.today()))
-                        if "return_date" not in args:
-                            args["return_date"] = str(st.session_state.get("end_date", datetime.date.today()))
-                        if "adults" not in args:
-                            args["adults"] = st.session_state.get("adult", 1)
-                        if "children" not in args:
-                            args["children"] = st.session_state.get("children", 0)
-
-
-                        parsed_args = FlightsInput(**args)
-
-                    else:
-                        result = "Unsupported tool"
-                        results.append(ToolMessage(tool_call_id=t["id"], name=t["name"], content=str(result)))
-                        continue
-
-                    result = self._tools[t["name"].strip()].invoke({"params": parsed_args})
-
-                except Exception as e:
-                    result = f"Tool call failed: {e}"
-
-            results.append(ToolMessage(tool_call_id=t["id"], name=t["name"], content=str(result)))
-        return {"messages": results}
\ No newline at end of file
+        all_ok = True
+        for invocation, outcome in zip(batch.invocations, outcomes):
+            result, ok = _unpack_outcome(outcome)
+            all_ok = all_ok and ok
+            results.append({"tool_name": invocation.tool_name, "result": result})
+        return results, all_ok
+
+    async def _run_invocation(self, invocation, call_id, semaphore, tool_semaphores):
+        # Decode here so a malformed invocation only fails itself, not the whole batch
+        call = {"name": invocation.tool_name, "args": orjson.loads(invocation.arguments), "id": call_id}
+        return await self._run_one(call, semaphore, tool_semaphores)
+
+    def _parse_args(self, name, args):
+        # The tool schemas wrap the inputs in "params"; fill defaults on the inner dict
+        args = dict(args.get("params", args))
+
+        if name == "hotels_finder":
+            if "q" not in args:
+                args["q"] = _first_destination()
+            if "check_in_date" not in args:
+                args["check_in_date"] = str(st.session_state.get("start_date", datetime.date.today()))
+            if "check_out_date" not in args:
+                args["check_out_date"] = str(st.session_state.get("end_date", datetime.date.today()))
+            if "adults" not in args:
+                args["adults"] = 2
+            if "hotel_class" not in args:
+                budget = st.session_state.get("budget", "Medium").lower()
+                if budget == "low":
+                    args["hotel_class"] = "1,2"
+                elif budget == "medium":
+                    args["hotel_class"] = "3,4"
+                elif budget == "high":
+                    args["hotel_class"] = "5"
+            if "sort_by" not in args:
+                budget = st.session_state.get("budget", "Medium").lower()
+                args["sort_by"] = "3" if budget == "low" else "8"
+
+            return HotelsInput(**args)
+
+        if name == "flights_finder":
+            cities_iata = _load_cities_iata()
+
+            if "departure_airport" not in args:
+                args["departure_airport"] = cities_iata.get(st.session_state.get("origin", "").lower())
+            if "arrival_airport" not in args:
+                args["arrival_airport"] = cities_iata.get(_first_destination().lower())
+            if "outbound_date" not in args:
+                args["outbound_date"] = str(st.session_state.get("start_date", datetime.date.today()))
+            if "return_date" not in args:
+                args["return_date"] = str(st.session_state.get("end_date", datetime.date.today()))
+            if "adults" not in args:
+                args["adults"] = st.session_state.get("adult", 1)
+            if "children" not in args:
+                args["children"] = st.session_state.get("children", 0)
+
+            return FlightsInput(**args)
+
+        return None
@@ -0,0 +1,29 @@
+from typing import List
+
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.tools import tool
+
+
+class ToolInvocation(BaseModel):
+    tool_name: str = Field(description='Name of the tool to invoke, e.g. hotels_finder or flights_finder')
+    arguments: str = Field(description='Arguments for the tool, encoded as a JSON object string')
+
+
+class BatchInput(BaseModel):
+    invocations: List[ToolInvocation] = Field(description='The tool calls to run in parallel')
+
+
+class BatchInputSchema(BaseModel):
+    params: BatchInput
+
+
+@tool(args_schema=BatchInputSchema)
+def batch_tool(params: BatchInput):
+    '''
+    Invoke multiple other tools in parallel with a single call.
+
+    Returns:
+        list: The requested invocations. The agent dispatches them itself.
+    '''
+
+    return [invocation.dict() for invocation in params.invocations]